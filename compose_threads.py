@@ -1,54 +1,144 @@
 #!/usr/bin/env python3
 
 import os
-import json
+import mmap
+import orjson
+import argparse
+import functools
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from datetime import datetime
-from typing import List, Dict
-import hashlib
+from typing import BinaryIO, List, Dict, Optional
+import xxhash
+try:
+    import ijson.backends.yajl2_c as ijson
+except ImportError:
+    # C backend not compiled for this platform; fall back to the best available one
+    import ijson
 
+COMPOSE_METADATA_FILE = ".compose_metadata.json"
+# Bump whenever get_content_hash changes so stale entries are recomposed once
+HASH_ALGO = "xxh3_128"
+# Bump whenever the layout of per-directory entries changes
+METADATA_VERSION = 2
+
+# Top-level issue.json scalars compose_thread reads; everything else is skipped
+_ISSUE_SCALARS = frozenset({'title', 'created_at', 'state', 'body'})
+
+# Thread separators, built once instead of per issue/comment
+_EQ = "=" * 80
+_DASH = "-" * 80
+_SUBDASH = "-" * 40
+_SEP = f"\n{_EQ}\n"
+
+@functools.lru_cache(maxsize=4096)
 def format_date(date_str: str) -> str:
-    dt = datetime.strptime(date_str, "%Y-%m-%dT%H:%M:%SZ")
+    # fromisoformat only accepts a trailing 'Z' from Python 3.11 on
+    dt = datetime.fromisoformat(date_str.replace('Z', '+00:00'))
     return dt.strftime("%Y-%m-%d %H:%M:%S UTC")
 
 def get_content_hash(filepath: str) -> str:
-    """Calculate SHA-256 hash of a file's content."""
+    """Calculate xxh3-128 hash of a file's content, reading it through mmap."""
     if not os.path.exists(filepath):
         return ""
     with open(filepath, 'rb') as f:
-        return hashlib.sha256(f.read()).hexdigest()
+        # mmap refuses to map empty files
+        if os.fstat(f.fileno()).st_size == 0:
+            return xxhash.xxh3_128(b"").hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return xxhash.xxh3_128(mm).hexdigest()
+
+def get_content_sig(filepath: str) -> List[int]:
+    """Return a cheap [mtime_ns, size] signature of a file, or [] if missing."""
+    try:
+        st = os.stat(filepath, follow_symlinks=False)
+    except FileNotFoundError:
+        return []
+    return [st.st_mtime_ns, st.st_size]
+
+class _HashingReader:
+    """Binary file wrapper that feeds every byte read through it into xxh3-128."""
+    
+    def __init__(self, f: BinaryIO):
+        self._f = f
+        self._hasher = xxhash.xxh3_128()
+    
+    def read(self, size: int = -1) -> bytes:
+        data = self._f.read(size)
+        self._hasher.update(data)
+        return data
+    
+    def hexdigest(self) -> str:
+        # Consume anything the parser left unread so the digest matches get_content_hash
+        while self.read(1 << 16):
+            pass
+        return self._hasher.hexdigest()
+
+def parse_issue_fields(f: BinaryIO) -> Dict:
+    """Extract the fields needed for a thread from issue.json without building the full object."""
+    issue = {'user': {}, 'labels': []}
+    for prefix, _, value in ijson.parse(f, use_float=True):
+        if prefix in _ISSUE_SCALARS:
+            issue[prefix] = value
+        elif prefix == 'user.login':
+            issue['user']['login'] = value
+        elif prefix == 'labels.item.name':
+            issue['labels'].append({'name': value})
+    return issue
 
 def load_compose_metadata() -> Dict:
     """Load metadata about previously composed threads."""
-    if os.path.exists(".compose_metadata.json"):
-        with open(".compose_metadata.json", 'r') as f:
-            return json.load(f)
-    return {}
+    if os.path.exists(COMPOSE_METADATA_FILE):
+        with open(COMPOSE_METADATA_FILE, 'rb') as f:
+            metadata = orjson.loads(f.read())
+        # Entries from a different algorithm or layout can never match, so drop them
+        if (metadata.get('hash_algo') == HASH_ALGO
+                and metadata.get('version') == METADATA_VERSION):
+            return metadata
+    return {'hash_algo': HASH_ALGO, 'version': METADATA_VERSION}
 
 def save_compose_metadata(metadata: Dict) -> None:
-    """Save metadata about composed threads."""
-    with open(".compose_metadata.json", 'w') as f:
-        json.dump(metadata, f, indent=2)
+    """Save metadata about composed threads, atomically replacing the old file."""
+    tmp_path = f"{COMPOSE_METADATA_FILE}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(orjson.dumps(metadata, option=orjson.OPT_INDENT_2))
+    os.replace(tmp_path, COMPOSE_METADATA_FILE)
 
-def compose_thread(directory: str, metadata: Dict) -> None:
+def compose_thread(directory: str, old_states: Dict, force_verify: bool = False,
+                   issue_sig: Optional[List[int]] = None) -> Dict:
+    """Compose thread.md for one issue directory and return its new cache entry.
+    
+    Pure with respect to the shared metadata so it can run in a worker process.
+    """
     # Check if files have been modified
     issue_path = os.path.join(directory, "issue.json")
     comments_path = os.path.join(directory, "comments.json")
     
-    current_hashes = {
-        'issue': get_content_hash(issue_path),
-        'comments': get_content_hash(comments_path)
-    }
+    old_issue = old_states.get('issue', {})
+    old_comments = old_states.get('comments', {})
+    if issue_sig is None:
+        issue_sig = get_content_sig(issue_path)
+    comments_sig = get_content_sig(comments_path)
     
-    # Skip if nothing has changed
-    if directory in metadata:
-        old_hashes = metadata[directory]
-        if old_hashes == current_hashes:
+    if force_verify:
+        # Compare full content hashes; a touched but identical file only refreshes its signature
+        current_states = {
+            'issue': {'sig': issue_sig, 'hash': get_content_hash(issue_path)},
+            'comments': {'sig': comments_sig, 'hash': get_content_hash(comments_path)}
+        }
+        if (old_issue.get('hash') == current_states['issue']['hash']
+                and old_comments.get('hash') == current_states['comments']['hash']):
             print(f"Skipping {directory} - no changes detected")
-            return
+            return current_states
+    elif old_issue.get('sig') == issue_sig and old_comments.get('sig') == comments_sig:
+        print(f"Skipping {directory} - no changes detected")
+        return old_states
     
-    # Read issue data
-    with open(issue_path, "r") as f:
-        issue = json.load(f)
+    # Read issue data, hashing it incrementally from the bytes the parser consumes
+    with open(issue_path, "rb") as f:
+        issue_reader = _HashingReader(f)
+        issue = parse_issue_fields(issue_reader)
+        issue_hash = issue_reader.hexdigest()
     
     # Prepare the conversation thread
     thread = []
@@ -57,40 +147,47 @@ def compose_thread(directory: str, metadata: Dict) -> None:
     thread.append(f"Title: {issue['title']}")
     thread.append(f"Created by: {issue['user']['login']} on {format_date(issue['created_at'])}")
     thread.append(f"State: {issue['state']}")
-    thread.append(f"Labels: {', '.join(label['name'] for label in issue['labels'])}")
-    thread.append("\n" + "="*80 + "\n")
+    labels_str = ", ".join([label['name'] for label in issue['labels']])
+    thread.append(f"Labels: {labels_str}")
+    thread.append(_SEP)
     
     # Add main issue body
     thread.append("INITIAL POST:")
-    thread.append("-"*80)
+    thread.append(_DASH)
     thread.append(issue['body'])
     
     # Add comments if they exist
-    if os.path.exists(comments_path):
-        with open(comments_path, "r") as f:
-            comments = json.load(f)
-        
-        if comments:
-            thread.append("\n" + "="*80 + "\n")
-            thread.append("COMMENTS:")
-            thread.append("-"*80)
-            
-            for comment in comments:
+    comments_hash = ""
+    if comments_sig:
+        # Stream comments one at a time instead of materializing the whole array
+        with open(comments_path, "rb") as f:
+            comments_reader = _HashingReader(f)
+            for i, comment in enumerate(ijson.items(comments_reader, 'item', use_float=True)):
+                if i == 0:
+                    thread.append(_SEP)
+                    thread.append("COMMENTS:")
+                    thread.append(_DASH)
+                
                 thread.append(f"\nOn {format_date(comment['created_at'])}, {comment['user']['login']} wrote:")
-                thread.append("-"*40)
+                thread.append(_SUBDASH)
                 thread.append(comment['body'])
+            comments_hash = comments_reader.hexdigest()
     
     # Write the thread to a file
     output_file = os.path.join(directory, "thread.md")
-    with open(output_file, "w") as f:
+    with open(output_file, "w", buffering=1 << 20) as f:
         f.write("\n\n".join(thread))
     
-    # Update metadata
-    metadata[directory] = current_hashes
+    return {
+        'issue': {'sig': issue_sig, 'hash': issue_hash},
+        'comments': {'sig': comments_sig, 'hash': comments_hash}
+    }
 
-def process_all_threads() -> None:
+def process_all_threads(force_verify: bool = False) -> None:
     metadata = load_compose_metadata()
-    processed = 0
+    issue_paths = []
+    issue_sigs = []
+    dirty = False
     
     # Walk through all label directories
     for label in ['faro', 'app-o11y']:
@@ -100,28 +197,47 @@ def process_all_threads() -> None:
         print(f"\nProcessing {label} issues...")
         
         # Walk through slug directories
-        for slug in os.listdir(label):
-            slug_path = os.path.join(label, slug)
-            if not os.path.isdir(slug_path):
-                continue
-            
-            # Walk through issue directories
-            for issue_id in os.listdir(slug_path):
-                issue_path = os.path.join(slug_path, issue_id)
-                if not os.path.isdir(issue_path):
+        with os.scandir(label) as slugs:
+            for slug in slugs:
+                if not slug.is_dir(follow_symlinks=False):
                     continue
                 
-                if os.path.exists(os.path.join(issue_path, "issue.json")):
-                    print(f"Checking thread for {label}/{slug}/{issue_id}")
-                    compose_thread(issue_path, metadata)
-                    processed += 1
+                # Walk through issue directories
+                with os.scandir(slug.path) as issue_dirs:
+                    for issue_dir in issue_dirs:
+                        if not issue_dir.is_dir(follow_symlinks=False):
+                            continue
+                        
+                        # One stat both detects issue.json and seeds its cache key
+                        issue_sig = get_content_sig(os.path.join(issue_dir.path, "issue.json"))
+                        if issue_sig:
+                            print(f"Checking thread for {label}/{slug.name}/{issue_dir.name}")
+                            issue_paths.append(issue_dir.path)
+                            issue_sigs.append(issue_sig)
     
-    save_compose_metadata(metadata)
-    print(f"\nDone! Processed {processed} issue directories")
+    # Each directory is independent, so compose them in parallel and merge here
+    old_states = [metadata.get(issue_path, {}) for issue_path in issue_paths]
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        results = executor.map(compose_thread, issue_paths, old_states,
+                               repeat(force_verify), issue_sigs, chunksize=16)
+        for issue_path, new_states in zip(issue_paths, results):
+            if metadata.get(issue_path) != new_states:
+                metadata[issue_path] = new_states
+                dirty = True
+    
+    # Leave the metadata file untouched on no-op runs
+    if dirty:
+        save_compose_metadata(metadata)
+    print(f"\nDone! Processed {len(issue_paths)} issue directories")
 
 def main():
+    parser = argparse.ArgumentParser(description="Compose human-readable threads from fetched issues")
+    parser.add_argument('--force-verify', action='store_true',
+                        help="re-hash file contents even when mtime and size are unchanged")
+    args = parser.parse_args()
+    
     print("Starting to compose conversation threads...")
-    process_all_threads()
+    process_all_threads(args.force_verify)
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
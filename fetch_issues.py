@@ -2,9 +2,12 @@
 
 import os
 import re
-import requests
-from typing import List, Dict, Set
+import shutil
+import asyncio
+import httpx
+from typing import List, Dict, Set, AsyncIterator, Optional, Tuple
 import json
+import orjson
 import sys
 from datetime import datetime, timezone
 from dotenv import load_dotenv
@@ -38,142 +41,241 @@ def get_valid_labels() -> Set[str]:
         print("Error: VALID_LABELS environment variable is required")
         sys.exit(1)
 
-VALID_LABELS = get_valid_labels()
-print(f"Using labels: {', '.join(sorted(VALID_LABELS))}")
+# Sorted so labels are always walked in the same order across runs
+VALID_LABELS_ORDERED = tuple(sorted(get_valid_labels()))
+print(f"Using labels: {', '.join(VALID_LABELS_ORDERED)}")
 
 BASE_URL = f"https://api.github.com/repos/{REPO}/issues"
 METADATA_FILE = ".fetch_metadata.json"
+_SLUG_RE = re.compile(r'\[([\w-]+)\]')
+# Issue fields worth persisting; the rest (reactions, assignees, milestone, ...) is never read.
+# A tuple rather than a set so keys are written in a stable order and file hashes stay put.
+_ISSUE_KEEP = ('number', 'title', 'user', 'state', 'created_at', 'updated_at',
+               'labels', 'body', 'comments', 'comments_url')
+_COMMENT_DROP = frozenset({'reactions', 'performed_via_github_app'})
+# Directories (and their parents) known to exist, so warm runs skip the makedirs stats
+_DIRS_ENSURED: Set[str] = set()
+# Cap on in-flight comment requests to stay under GitHub's secondary rate limits
+MAX_CONCURRENT_REQUESTS = 20
 
 def load_metadata() -> Dict:
     if os.path.exists(METADATA_FILE):
-        with open(METADATA_FILE, 'r') as f:
-            return json.load(f)
+        with open(METADATA_FILE, 'rb') as f:
+            return orjson.loads(f.read())
     return {'last_fetch': '1970-01-01T00:00:00Z', 'issues': {}}
 
 def save_metadata(metadata: Dict) -> None:
-    with open(METADATA_FILE, 'w') as f:
-        json.dump(metadata, f, indent=2)
+    # Write to a temp file and rename so an interrupted run can't truncate the metadata
+    tmp_path = f"{METADATA_FILE}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(orjson.dumps(metadata, option=orjson.OPT_INDENT_2))
+    os.replace(tmp_path, METADATA_FILE)
+
+def ensure_dir(directory: str) -> None:
+    if directory in _DIRS_ENSURED:
+        return
+    parent = os.path.dirname(directory)
+    if parent in _DIRS_ENSURED:
+        # Parents are known to exist, so a single mkdir is enough
+        try:
+            os.mkdir(directory)
+        except FileExistsError:
+            pass
+    else:
+        os.makedirs(directory, exist_ok=True)
+    while directory and directory not in _DIRS_ENSURED:
+        _DIRS_ENSURED.add(directory)
+        directory = os.path.dirname(directory)
+
+def _save_file(path: str, data: bytes) -> None:
+    with open(path, 'wb') as f:
+        f.write(data)
 
 def extract_slug(title: str) -> str:
-    match = re.search(r'\[([\w-]+)\]', title)
+    # Fast path for the usual "[slug] rest of title" form
+    if title.startswith('['):
+        end = title.find(']')
+        candidate = title[1:end] if end > 0 else ""
+        if candidate and all(c.isalnum() or c in '-_' for c in candidate):
+            return candidate
+    match = _SLUG_RE.search(title)
     return match.group(1) if match else "unknown"
 
-def fetch_comments(comments_url: str) -> List[Dict]:
+async def fetch_comments(client: httpx.AsyncClient, semaphore: asyncio.Semaphore,
+                         comments_url: str, etag: Optional[str] = None) -> Tuple[Optional[List[Dict]], Optional[str]]:
+    """Fetch an issue's comments and their ETag.
+    
+    Returns (None, etag) when GitHub answers 304 Not Modified for the given ETag.
+    """
+    headers = {'If-None-Match': etag} if etag else None
     try:
-        response = requests.get(
-            comments_url,
-            headers=HEADERS,
-            timeout=30
-        )
+        async with semaphore:
+            response = await client.get(comments_url, headers=headers)
+        if response.status_code == 304:
+            return None, etag
         response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
+        return orjson.loads(response.content), response.headers.get('ETag')
+    except httpx.HTTPStatusError as e:
         print(f"Error fetching comments: {e}")
-        print("Response:", getattr(e.response, 'text', 'No response text'))
-        return []
+        print("Response:", e.response.text)
+        return [], None
+    except httpx.HTTPError as e:
+        print(f"Error fetching comments: {e!r}")
+        return [], None
     except json.JSONDecodeError as e:
         print(f"Error decoding comments JSON: {e}")
-        return []
+        return [], None
 
-def process_issue(issue: Dict, label: str, metadata: Dict) -> None:
+async def process_issue(client: httpx.AsyncClient, semaphore: asyncio.Semaphore,
+                        issue: Dict, label: str, metadata: Dict) -> None:
     issue_id = str(issue['number'])
     issue_key = f"{label}/{issue_id}"
     
     # Check if issue needs updating
-    if issue_key in metadata['issues']:
-        last_updated = metadata['issues'][issue_key]['updated_at']
+    previous = metadata['issues'].get(issue_key, {})
+    if previous:
+        last_updated = previous['updated_at']
         if issue['updated_at'] <= last_updated:
             print(f"Skipping issue {issue_id} - no updates since {last_updated}")
             return
 
     slug = extract_slug(issue['title'])
     directory = f"{label}/{slug}/{issue_id}"
-    os.makedirs(directory, exist_ok=True)
+    ensure_dir(directory)
     
-    # Save main issue data
-    with open(f"{directory}/issue.json", 'w') as f:
-        json.dump(issue, f, indent=2)
+    # Save main issue data; stored compact since only compose_threads.py reads it
+    # Disk writes run in a worker thread so they don't stall in-flight requests
+    await asyncio.to_thread(_save_file, f"{directory}/issue.json",
+                            orjson.dumps({k: issue[k] for k in _ISSUE_KEEP if k in issue}))
     
     # Fetch and save comments if they exist
+    comments_etag = None
     if issue['comments'] > 0:
         print(f"Fetching {issue['comments']} comments for issue {issue_id}")
-        comments = fetch_comments(issue['comments_url'])
-        if comments:
-            with open(f"{directory}/comments.json", 'w') as f:
-                json.dump(comments, f, indent=2)
+        # Only offer the ETag if the comments it describes are still on disk
+        cached_path = f"{previous['path']}/comments.json" if previous else None
+        etag = previous.get('comments_etag') if cached_path and os.path.exists(cached_path) else None
+        comments, comments_etag = await fetch_comments(client, semaphore, issue['comments_url'], etag)
+        if comments is None:
+            print(f"Comments for issue {issue_id} not modified")
+            if cached_path != f"{directory}/comments.json":
+                await asyncio.to_thread(shutil.copyfile, cached_path, f"{directory}/comments.json")
+        elif comments:
+            await asyncio.to_thread(_save_file, f"{directory}/comments.json", orjson.dumps([
+                {k: v for k, v in comment.items() if k not in _COMMENT_DROP}
+                for comment in comments
+            ]))
     
     # Update metadata
     metadata['issues'][issue_key] = {
         'updated_at': issue['updated_at'],
-        'path': directory
+        'path': directory,
+        'comments_etag': comments_etag
     }
     
     print(f"Saved issue {issue_id} with slug '{slug}' under label '{label}' ({issue['comments']} comments)")
 
-def fetch_and_process_issues(label: str, metadata: Dict) -> None:
-    page = 1
-    total_processed = 0
-    
-    while True:
-        try:
-            print(f"Fetching page {page} for label '{label}'...")
-            response = requests.get(
+async def fetch_issue_page(client: httpx.AsyncClient, semaphore: asyncio.Semaphore,
+                           label: str, metadata: Dict, page: int) -> Tuple[List[Dict], int]:
+    """Fetch one page of issues for a label, returning it with the last page number."""
+    try:
+        print(f"Fetching page {page} for label '{label}'...")
+        async with semaphore:
+            response = await client.get(
                 BASE_URL,
-                headers=HEADERS,
                 params={
                     'state': 'all',
                     'per_page': 100,
                     'page': page,
                     'labels': label,
                     'since': metadata['last_fetch']  # Only fetch issues updated since last fetch
-                },
-                timeout=30
+                }
             )
-            
-            if response.status_code == 401:
-                print("Error: Invalid authentication token")
-                print("Response:", response.text)
-                sys.exit(1)
-            
-            if response.status_code == 403:
-                print("Error: API rate limit exceeded or permission denied")
-                print("Response:", response.text)
-                sys.exit(1)
-                
-            response.raise_for_status()
-            
-            batch = response.json()
-            if not batch:
-                break
-                
-            print(f"Retrieved {len(batch)} issues")
-            
-            for issue in batch:
-                process_issue(issue, label, metadata)
-                total_processed += 1
-            
-            page += 1
-            
-        except requests.exceptions.RequestException as e:
-            print(f"Error during API request: {e}")
-            print("Response:", getattr(e.response, 'text', 'No response text'))
+        
+        if response.status_code == 401:
+            print("Error: Invalid authentication token")
+            print("Response:", response.text)
             sys.exit(1)
-        except json.JSONDecodeError as e:
-            print(f"Error decoding JSON response: {e}")
-            print("Response text:", response.text)
+        
+        if response.status_code == 403:
+            print("Error: API rate limit exceeded or permission denied")
+            print("Response:", response.text)
             sys.exit(1)
+            
+        response.raise_for_status()
+        
+        batch = orjson.loads(response.content)
+        
+    except httpx.HTTPStatusError as e:
+        print(f"Error during API request: {e}")
+        print("Response:", e.response.text)
+        sys.exit(1)
+    except httpx.HTTPError as e:
+        print(f"Error during API request: {e!r}")
+        sys.exit(1)
+    except json.JSONDecodeError as e:
+        print(f"Error decoding JSON response: {e}")
+        print("Response text:", response.text)
+        sys.exit(1)
+    
+    # GitHub only sends rel="last" when there is more than one page
+    last_url = response.links.get('last', {}).get('url')
+    last_page = int(httpx.URL(last_url).params.get('page', page)) if last_url else page
+    return batch, last_page
+
+async def fetch_issue_pages(client: httpx.AsyncClient, semaphore: asyncio.Semaphore,
+                            label: str, metadata: Dict) -> AsyncIterator[List[Dict]]:
+    """Yield each page of issues for a label.
+    
+    The first page's Link header tells us the page count, so the remaining
+    pages are requested concurrently and yielded in completion order.
+    """
+    batch, last_page = await fetch_issue_page(client, semaphore, label, metadata, 1)
+    if not batch:
+        return
+    print(f"Retrieved {len(batch)} issues")
+    yield batch
+    
+    pending = [
+        asyncio.ensure_future(fetch_issue_page(client, semaphore, label, metadata, page))
+        for page in range(2, last_page + 1)
+    ]
+    try:
+        for next_page in asyncio.as_completed(pending):
+            batch, _ = await next_page
+            if batch:
+                print(f"Retrieved {len(batch)} issues")
+                yield batch
+    finally:
+        for task in pending:
+            task.cancel()
+
+async def fetch_and_process_issues(client: httpx.AsyncClient, semaphore: asyncio.Semaphore,
+                                   label: str, metadata: Dict) -> int:
+    total_processed = 0
+    
+    async for batch in fetch_issue_pages(client, semaphore, label, metadata):
+        # Issues on a page are independent, so their comment fetches run concurrently
+        await asyncio.gather(*[
+            process_issue(client, semaphore, issue, label, metadata)
+            for issue in batch
+        ])
+        total_processed += len(batch)
     
     return total_processed
 
-def main():
+async def main():
     metadata = load_metadata()
     total_issues = 0
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
     
-    for label in VALID_LABELS:
-        print(f"\nProcessing issues with label: {label}")
-        processed = fetch_and_process_issues(label, metadata)
-        total_issues += processed
-        print(f"Completed processing {processed} issues for label '{label}'")
+    # One HTTP/2 connection is reused and multiplexed across all requests
+    async with httpx.AsyncClient(http2=True, headers=HEADERS, timeout=30) as client:
+        for label in VALID_LABELS_ORDERED:
+            print(f"\nProcessing issues with label: {label}")
+            processed = await fetch_and_process_issues(client, semaphore, label, metadata)
+            total_issues += processed
+            print(f"Completed processing {processed} issues for label '{label}'")
     
     # Update last fetch time
     metadata['last_fetch'] = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
@@ -182,4 +284,4 @@ def main():
     print(f"\nDone! Processed {total_issues} total issues")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    asyncio.run(main()) 
\ No newline at end of file